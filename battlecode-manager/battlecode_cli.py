@@ -3,7 +3,6 @@ t
 This file contains contains the CLI that starts games up
 '''
 
-import time
 import os
 import logging
 from os.path import abspath
@@ -16,12 +15,30 @@ try:
     import ujson as json
 except:
     import json
+try:
+    # orjson encodes straight to bytes, so there is no extra str copy of the replay to .encode()
+    import orjson
+    def dumps_bytes(obj):
+        return orjson.dumps(obj)
+except:
+    def dumps_bytes(obj):
+        return json.dumps(obj).encode()
 import io
 import sys
 
 # TODO port number
 PORT = 16147
 
+# Created on first use, so games without docker never import or contact it
+DOCKER_CLIENT = None
+
+def get_docker_client():
+    global DOCKER_CLIENT
+    if DOCKER_CLIENT is None:
+        import docker
+        DOCKER_CLIENT = docker.from_env()
+    return DOCKER_CLIENT
+
 class Logger(object):
     def __init__(self, prefix, print=True, limit=2**63):
         self.logs = io.StringIO()
@@ -33,7 +50,8 @@ class Logger(object):
 
     def __call__(self, v):
         if self.len < self.limit:
-            data = v.decode()
+            # Player output can be any bytes; a bad line must not stop its logging
+            data = v.decode(errors='replace')
             self.logs.write(data)
             if self.print:
                 print(self.prefix, data, end='')
@@ -45,6 +63,15 @@ class Logger(object):
             if self.print:
                 print(self.prefix, msg, end='')
 
+    def take(self):
+        '''
+        Return everything logged so far and start a new, empty log.
+        The old buffer is released, so only one copy of the logs is held.
+        '''
+        value = self.logs.getvalue()
+        self.logs = io.StringIO()
+        return value
+
 def working_dir_message(working_dir):
     print('Working directory:', working_dir)
     print('You may want to empty it periodically.')
@@ -83,28 +110,18 @@ def run_game(game, dockers, args, sock_file, scrimmage=False):
         for player_key in dockers:
             docker_inst = dockers[player_key]
             docker_inst.start()
-            for player_ in game.players:
-                if player_['id'] == player_key:
-                    player = player_['player']
-                    break
-            if player.planet == bc.Planet.Earth:
-                planet = 'earth'
-            else:
-                planet = 'mars'
-            if player.team == bc.Team.Blue:
-                team = 'blue'
-            else:
-                team = 'red'
-
-            name = '[{}:{}]'.format(planet, team)
+            player = game.get_player(player_key)
+
+            name = '[{}:{}]'.format(player['planet_name'], player['team_name'])
             # 10 MB of logs in scrimmage, unlimited logging otherwise
             logger = Logger(name, print=not args['terminal_viewer'], limit=10**7 if scrimmage else 2**63)
             docker_inst.stream_logs(line_action=logger)
-            player_['logger'] = logger
+            player['logger'] = logger
 
-        # Wait until all the code is done then clean up
-        while not game.game_over:
-            time.sleep(0.1)
+        # Wait until all the code is done then clean up.
+        # Wake up every second anyway so Ctrl-C still gets through on every platform.
+        while not game.game_over_event.wait(1):
+            pass
 
     finally:
         main_server.shutdown()
@@ -143,9 +160,8 @@ def run_game(game, dockers, args, sock_file, scrimmage=False):
     if not scrimmage:
         print("Saving replay to", match_output)
 
-        match_ptr = open(match_output, 'w')
-        json.dump(match_file, match_ptr)
-        match_ptr.close()
+        with open(match_output, 'wb') as match_ptr:
+            match_ptr.write(dumps_bytes(match_file))
 
         return winner
     else:
@@ -237,16 +253,16 @@ def create_game(args):
             raise Exception("Do you really have 10000 /tmp/battlecode sockets???")
         print('Running game server on socket unix://{}'.format(sock_file))
 
+    if args['docker']:
+        # One client for all players, so they share its connection pool to the daemon
+        docker_instance = get_docker_client()
+
     # Assign the docker instances client ids
     dockers = {}
     for index in range(len(game.players)):
         key = [player['id'] for player in game.players][index]
         local_dir = args['dir_p1' if index % 2 == 0 else 'dir_p2']
         if args['docker']:
-            # Note, importing a module multiple times is ok in python.
-            # It might take a bit of time to verify that it is already imported though, but that should be negligable.
-            import docker
-            docker_instance = docker.from_env()
             dockers[key] = SandboxedPlayer(sock_file, working_dir=working_dir, docker_client=docker_instance, player_key=key, local_dir=local_dir)
         else:
             dockers[key] = PlainPlayer(sock_file, working_dir=working_dir, player_key=key, local_dir=local_dir)
@@ -276,8 +292,7 @@ def create_scrimmage_game(args):
             break
 
     # Assign the docker instances client ids
-    import docker
-    docker_instance = docker.from_env()
+    docker_instance = get_docker_client()
     dockers = {}
     for index in range(len(game.players)):
         key = [player['id'] for player in game.players][index]
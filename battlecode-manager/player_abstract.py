@@ -1,49 +1,61 @@
-from pathlib import Path
 import os
-import string
-import random
-import io
+import secrets
+import tempfile
 import zipfile
 from shutil import copytree, rmtree
 import sys
 
 
 def random_key(length):
-    return ''.join([random.choice(string.ascii_letters + string.digits) for _ in range(length)])
+    # token_urlsafe gives ~1.3 characters per byte, so this is always long enough
+    return secrets.token_urlsafe(length)[:length]
 
 
 def extract_s3_bucket(bucket, key, destination_directory):
-    obj = bucket.Object(key)
+    # Only a missing key or a file that isn't a zip means the key is invalid, anything else is our bug
+    invalid_key_errors = (bucket.meta.client.exceptions.ClientError, zipfile.BadZipFile)
     try:
-        with io.BytesIO(obj.get()["Body"].read()) as tf:
+        # Stream the download in chunks instead of reading the whole body into one bytes object.
+        # Not a SpooledTemporaryFile: zipfile needs seekable(), which it lacks before Python 3.11
+        with tempfile.TemporaryFile() as tf:
+            bucket.download_fileobj(key, tf)
             tf.seek(0)
             with zipfile.ZipFile(tf, mode='r') as zipf:
                 zipf.extractall(path=destination_directory)
         return True
-    except Exception as e:
-        print("Invalid s3 key.")
+    except invalid_key_errors as e:
+        print("Invalid s3 key.", e)
         return False
 
 
+def _script_files(directory):
+    ''' Yields the paths of all .py and .sh files in the given directory (recursively), in a single walk '''
+    stack = [directory]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(('.py', '.sh')):
+                    yield entry.path
+
+
 def dos2unix(directory):
     ''' Converts all .py and .sh files in the given directory (recursively) to use unix line endings '''
-    pathlist = list(Path(directory).glob("**/*.py"))
-    pathlist += list(Path(directory).glob("**/*.sh"))
-
-    for path in pathlist:
+    for path in _script_files(directory):
         try:
-            with open(str(path), 'r') as f:
+            with open(path, 'r') as f:
                 x = f.read()
         except UnicodeDecodeError as e:
             try:
                 print("Trying Latin encoding...")
-                with open(str(path), 'r', encoding='ISO-8859-1') as f:
+                with open(path, 'r', encoding='ISO-8859-1') as f:
                     x = f.read()
             except Exception as e2:
                 print(e2)
                 x = 'echo "Unable to read file (please encode as unicode)."'
 
-        with open(str(path), 'w') as f:
+        with open(path, 'w') as f:
             f.write(x.replace('\r\n', '\n'))
 
 
@@ -56,21 +68,22 @@ class AbstractPlayer:
         self.socket_file = socket_file
 
         # Note that working dir is an absolute path
-        self.working_dir = os.path.abspath(os.path.join(working_dir, random_key(20)))
+        working_dir = os.path.abspath(working_dir)
+        self.working_dir = os.path.join(working_dir, random_key(20))
 
-        if not os.path.exists(working_dir):
-            os.makedirs(working_dir)
+        os.makedirs(working_dir, exist_ok=True)
 
         if s3_bucket:
             if not extract_s3_bucket(s3_bucket, s3_key, self.working_dir):
                 raise ValueError("Incorrect s3 key provided.")
         elif local_dir:
-            # print("Copying files from {} to {}".format(os.path.abspath(local_dir), self.working_dir))
+            local_dir = os.path.abspath(local_dir)
+            # print("Copying files from {} to {}".format(local_dir, self.working_dir))
             try:
-                copytree(os.path.abspath(local_dir), self.working_dir)
+                copytree(local_dir, self.working_dir)
             except Exception as e:
-                print("Failed to copy files from {} to {}\nMake sure you don't have any broken symlinks in your player directory for example" +
-                      " and that your dog didn't eat your hard drive.".format(os.path.abspath(local_dir), self.working_dir))
+                print(("Failed to copy files from {} to {}\nMake sure you don't have any broken symlinks in your player directory for example" +
+                      " and that your dog didn't eat your hard drive.").format(local_dir, self.working_dir))
                 raise
         else:
             raise ValueError("Must provide either S3 key and bucket or local directory for code.")
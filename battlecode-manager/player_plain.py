@@ -2,13 +2,122 @@ import os
 import psutil
 import subprocess
 import threading
+import signal
 import sys
-from threading import Timer
 import select
+import selectors
+import collections
 
 from player_abstract import AbstractPlayer
 
 
+class LogPump(object):
+    '''
+    Reads the stdout/stderr pipes of every PlainPlayer on one shared thread,
+    instead of running a blocking reader thread per pipe.
+    Not used on windows, where select() only works on sockets.
+    '''
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        # Writing to this pipe wakes the pump so it notices newly added streams
+        self.wake_read, self.wake_write = os.pipe()
+        self.selector.register(self.wake_read, selectors.EVENT_READ, None)
+        # Streams other threads asked to stop reading, closed by the pump thread
+        self.removed = collections.deque()
+        self.thread = threading.Thread(target=self.run_forever, daemon=True)
+        self.thread.start()
+
+    def add(self, player, stream, line_action):
+        os.set_blocking(stream.fileno(), False)
+        # data is (player, line_action, bytes of an unfinished line, stream).
+        # Holding the stream keeps it open until the pump thread closes it itself
+        self.selector.register(stream.fileno(), selectors.EVENT_READ, [player, line_action, b'', stream])
+        os.write(self.wake_write, b'\0')
+
+    def remove(self, stream):
+        '''
+        Stops reading the stream and closes it. The pump thread does the closing, as it
+        may be about to read the stream's fd, which could by then belong to another pipe.
+        '''
+        self.removed.append(stream)
+        os.write(self.wake_write, b'\0')
+
+    def _close(self, stream):
+        if stream.closed:
+            # Already reached EOF
+            return
+        try:
+            self.selector.unregister(stream.fileno())
+        except (KeyError, ValueError):
+            pass
+        stream.close()
+
+    def run_forever(self):
+        while True:
+            for key, _ in self.selector.select():
+                if key.data is None:
+                    os.read(self.wake_read, 4096)
+                    while self.removed:
+                        self._close(self.removed.popleft())
+                    continue
+                self._read(key)
+
+    def _read(self, key):
+        player, line_action, partial, stream = key.data
+        if stream.closed:
+            # Closed earlier in this batch of events, its fd may be another pipe's now
+            return
+        try:
+            chunk = os.read(key.fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            chunk = b''
+
+        if player.process is None:
+            # The player is being shut down, ignore anything else it says
+            self._close(stream)
+            return
+
+        if not chunk:
+            # EOF
+            self._close(stream)
+            if partial:
+                self._emit(key, partial)
+            return
+
+        lines = (partial + chunk).split(b'\n')
+        key.data[2] = lines.pop()
+        for line in lines:
+            self._emit(key, line + b'\n')
+
+    def _emit(self, key, line):
+        '''
+        Hands a line to the stream's line_action. If that raises, the rest of
+        the stream is read and dropped: the exception must not kill the pump,
+        which every other player's logs depend on, and the player must not
+        block on a full pipe.
+        '''
+        line_action = key.data[1]
+        if line_action is None:
+            return
+        try:
+            line_action(line)
+        except Exception as e:
+            print("Error handling player output, discarding the rest of this stream:", repr(e))
+            key.data[1] = None
+
+
+LOG_PUMP = None
+
+def _log_pump():
+    global LOG_PUMP
+    if LOG_PUMP is None:
+        LOG_PUMP = LogPump()
+    return LOG_PUMP
+
+
 class PlainPlayer(AbstractPlayer):
     def __init__(self, socket_file, working_dir, local_dir=None,
                  player_key="", player_mem_limit=256, player_cpu=20):
@@ -22,6 +131,14 @@ class PlainPlayer(AbstractPlayer):
     def stream_logs(self, stdout=True, stderr=True, line_action=lambda line: print(line.decode())):
         assert not self.streaming
         self.streaming = True
+        if sys.platform != 'win32':
+            pump = _log_pump()
+            if stdout:
+                pump.add(self, self.process.stdout, line_action)
+            if stderr:
+                pump.add(self, self.process.stderr, line_action)
+            return
+
         if stdout:
             threading.Thread(target=self._stream_logs, args=(self.process.stdout, line_action), daemon=True).start()
         if stderr:
@@ -54,10 +171,15 @@ class PlainPlayer(AbstractPlayer):
             env['SOCKET_FILE'] = self.socket_file
 
         cwd = self.working_dir
-        self.process = psutil.Popen(args, env=env, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=-1)
+        if sys.platform == 'win32':
+            self.process = subprocess.Popen(args, env=env, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=-1)
+        else:
+            # Give the player its own process group, so pausing it is a single killpg (see suspend)
+            self.process = subprocess.Popen(args, env=env, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=-1,
+                                            start_new_session=True)
 
     def guess_language(self):
-        children = self.process.children(recursive=True)
+        children = psutil.Process(self.process.pid).children(recursive=True)
         for c in children:
             name = c.exe()
             if "java" in name:
@@ -87,11 +209,18 @@ class PlainPlayer(AbstractPlayer):
     def destroy(self):
         if self.process is not None:
             tmp = self.process
+            if self.streaming and LOG_PUMP is not None:
+                # The pump closes the pipes, so their fds can't be reused while it still reads them
+                LOG_PUMP.remove(tmp.stdout)
+                LOG_PUMP.remove(tmp.stderr)
             # This will signal to the log thread that everything is going to be shut down
             # and ignore any future messages. In particular bash may log something like 'Terminated: <PID>'
             # which would pollute the output of this script.
             self.process = None
-            reap(tmp)
+            try:
+                reap(psutil.Process(tmp.pid))
+            except psutil.NoSuchProcess:
+                pass
             self.process = None
         super().destroy()
 
@@ -122,30 +251,18 @@ def reap(process, timeout=3):
         print("Killing failed; assuming process exited early.")
 
 def suspend(process):
-
-    procs = process.children(recursive=False)
+    # The player leads its own process group (see PlainPlayer.start), so this stops
+    # all of its processes with one signal instead of walking /proc for its children.
     # to enterprising players reading this code:
-    # yes, it is possible to escape the pausing using e.g. `nohup` when running without docker.
+    # yes, it is possible to escape the pausing using e.g. `setsid` when running without docker.
     # however, that won't work while running inside docker. Sorry.
-    for p in procs:
-        try:
-            p.suspend()
-        except:
-            pass
     try:
-        p.suspend()
-    except:
+        os.killpg(process.pid, signal.SIGSTOP)
+    except OSError:
         pass
 
 def resume(process):
-    procs = process.children(recursive=True)
-    for p in procs:
-        try:
-            p.resume()
-        except:
-            pass
     try:
-        p.resume()
-    except:
+        os.killpg(process.pid, signal.SIGCONT)
+    except OSError:
         pass
-
@@ -1,5 +1,4 @@
 import threading
-from threading import Timer
 
 from player_abstract import AbstractPlayer
 
@@ -7,6 +6,16 @@ import random
 import socket
 import server
 
+SANDBOX_IMAGE = 'battlebaby'
+# Id of SANDBOX_IMAGE, looked up once so starting a container doesn't resolve the tag again
+_sandbox_image_id = None
+
+def _sandbox_image(docker_client):
+    global _sandbox_image_id
+    if _sandbox_image_id is None:
+        _sandbox_image_id = docker_client.images.get(SANDBOX_IMAGE).id
+    return _sandbox_image_id
+
 def _stream_logs(container, stdout, stderr, line_action):
     for line in container.logs(stdout=stdout, stderr=stderr, stream=True):
         line_action(line)
@@ -45,7 +54,7 @@ class SandboxedPlayer(AbstractPlayer):
        }
 
         self.container = self.docker.containers.run(
-            'battlebaby',
+            _sandbox_image(self.docker),
             command,
             privileged=False,
             detach=True,
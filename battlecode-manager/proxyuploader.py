@@ -1,4 +1,12 @@
-import os, threading, time, json, random, nonsense, socket
+import os, threading, time, random, nonsense, socket
+try:
+    import ujson as json
+except:
+    import json
+
+# Bounds (seconds) of the backoff between reconnection attempts
+RETRY_MIN = 1
+RETRY_MAX = 30
 
 class ProxyUploader():
     def __init__(self):
@@ -6,34 +14,42 @@ class ProxyUploader():
         self.blue_id = 0
         self.game_id = 0
         self.game = None
-        self.start = time.time()
+        self.start_time = time.time()
         self.games_run = 0
         self.id = random.choice(nonsense.NONSENSE) + '-' + random.choice(nonsense.NONSENSE)
         self.done = False
-        if 'SCRIMMAGE_UPDATE_EVERY' in os.environ:
-            self.update_every = os.environ['SCRIMMAGE_UPDATE_EVERY']
-        else:
-            self.update_every = 1
-        if 'SCRIMMAGE_PROXY_URL' in os.environ:
-            self.url = os.environ['SCRIMMAGE_PROXY_URL']
-            self.secret = os.environ['SCRIMMAGE_PROXY_SECRET']
-            self.thread = threading.Thread(target=self.run_forever, args=(), daemon=True)
-            self.thread.start()
-        else:
+        self.thread = None
+        self.update_every = float(os.environ.get('SCRIMMAGE_UPDATE_EVERY', 1))
+        self.url = os.environ.get('SCRIMMAGE_PROXY_URL')
+        self.secret = os.environ.get('SCRIMMAGE_PROXY_SECRET', '')
+
+    def start(self):
+        '''
+        Start reporting to the scrimmage proxy in the background, if one is configured.
+        Kept out of __init__ so that creating an uploader never touches the network.
+        '''
+        if self.url is None:
             print("Not chatting with scrimmage proxy.")
+            return
+        self.thread = threading.Thread(target=self.run_forever, args=(), daemon=True)
+        self.thread.start()
 
     def run_forever(self):
+        # Wait this long before reconnecting after a failure, doubling up to RETRY_MAX
+        delay = RETRY_MIN
         while not self.done:
             try:
                 self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 self.socket.settimeout(30)
+                # Our messages are small and we wait for each reply, so don't let Nagle hold them back
+                self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
                 self.socket.connect((self.url, 56147))
-                self.f = self.socket.makefile('rwb')
+                self.f = self.socket.makefile('rb')
                 while not self.done:
                     msg = {
                         "id": self.id,
                         "secret": self.secret,
-                        "uptime_ms": int((time.time() - self.start) * 1000),
+                        "uptime_ms": int((time.time() - self.start_time) * 1000),
                         "games_run": self.games_run
                     }
                     if self.game is not None:
@@ -43,11 +59,16 @@ class ProxyUploader():
                         game['blue']['id'] = int(self.blue_id)
                         msg['game'] = game
 
-                    self.f.write((json.dumps(msg) + '\n').encode('utf-8'))
-                    self.f.flush()
+                    self.socket.sendall((json.dumps(msg) + '\n').encode('utf-8'))
                     m = next(self.f)
                     assert m.decode().strip() == 'ok', 'wrong resp: {}'.format(m.strip())
+                    delay = RETRY_MIN
                     time.sleep(self.update_every)
             except Exception as e:
                 print('some sort of failure', e)
-                time.sleep(10)
+                try:
+                    self.socket.close()
+                except Exception:
+                    pass
+                time.sleep(delay)
+                delay = min(delay * 2, RETRY_MAX)
@@ -1,39 +1,117 @@
 import psycopg2
-import json
+import psycopg2.pool
+import psycopg2.extensions
+import select
+import contextlib
+import functools
 import os
 import battlecode_cli as cli
-import threading
+from battlecode_cli import dumps_bytes
+import concurrent.futures
 import boto3
-from time import sleep
-import socket
-import time
-import nonsense
-import random
+import secrets
 import proxyuploader
 import gzip
-import string
-
-pg = None
-cur = None
-BUSY = False
-DB_LOCK = False
+import tempfile
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+DB_POOL = None
+# Whoever queues a game should NOTIFY this channel, as scripts/matchmaker.py and
+# scripts/tournament_single_elim.py do; we also notify it ourselves when a match ends
+QUEUE_CHANNEL = 'game_queued'
+# Rescan anyway this often (seconds) to pick up stale 'running' games, which nothing
+# notifies about, and games from a queuer that doesn't NOTIFY
+POLL_TIMEOUT = 10
 GAMES_RUN = []
-
-s3 = boto3.resource('s3')
+# Games run one at a time on this single worker; CURRENT_MATCH is the future of the latest one
+MATCH_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+CURRENT_MATCH = None
+
+# Replay and logs of a game are uploaded in parallel on these threads
+UPLOAD_WORKERS = 3
+UPLOAD_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=UPLOAD_WORKERS)
+# Replays bigger than this go up as a multipart upload of parts this size, this many parts at a time
+REPLAY_PART_SIZE = 8 * 1024 * 1024
+REPLAY_CONCURRENCY = 4
+REPLAY_TRANSFER = TransferConfig(multipart_threshold=REPLAY_PART_SIZE, multipart_chunksize=REPLAY_PART_SIZE, max_concurrency=REPLAY_CONCURRENCY)
+
+# Bot zips are downloaded with boto3's default transfer config, which uses this many threads
+DOWNLOAD_CONCURRENCY = 10
+
+# Enough HTTP connections that every upload thread, including the replay's part uploads, has one,
+# and so does every download thread (downloads and uploads never overlap, a game's uploads finish
+# before the next game starts), and retry transient S3 errors instead of failing the whole game
+s3 = boto3.resource('s3', config=Config(max_pool_connections=max(DOWNLOAD_CONCURRENCY, UPLOAD_WORKERS + REPLAY_CONCURRENCY), retries={'max_attempts': 5}))
 bucket = s3.Bucket(os.environ['BUCKET_NAME'])
+# Resources aren't thread safe and go through extra attribute lookups on every call,
+# so uploads use the low level client, which is thread safe
+S3_CLIENT = s3.meta.client
 key_prefix = 'tournament/' + os.environ['TOURNAMENT'] + '/' if 'TOURNAMENT' in os.environ else ''
 
 def random_key(length):
-    return ''.join([random.choice(string.ascii_letters + string.digits + string.digits) for _ in range(length)])
+    # Keys make replay and log URLs unguessable, so they come from the OS's secure RNG
+    return secrets.token_urlsafe(length)[:length]
 
 PROXY_UPLOADER = proxyuploader.ProxyUploader()
 
-def end_game(data,winner,match_file,logs):
-    global BUSY
-    global DB_LOCK
-
-    BUSY = False
+def write_replay(match_file, fileobj):
+    '''
+    Gzip the replay into fileobj one viewer message at a time, so the
+    whole replay JSON never has to be held in memory at once.
+    '''
+    with gzip.GzipFile(fileobj=fileobj, mode='wb') as gz:
+        gz.write(b'{"message":[')
+        for index, message in enumerate(match_file['message']):
+            if index:
+                gz.write(b',')
+            gz.write(dumps_bytes(message))
+        gz.write(b'],"metadata":')
+        gz.write(dumps_bytes(match_file['metadata']))
+        gz.write(b'}')
+
+def upload_replay(key, match_file):
+    # Spills to disk past one part, so memory use doesn't grow with the replay
+    with tempfile.SpooledTemporaryFile(max_size=REPLAY_PART_SIZE) as replay:
+        write_replay(match_file, replay)
+        replay.seek(0)
+        S3_CLIENT.upload_fileobj(replay, bucket.name, key, ExtraArgs={'ACL': 'public-read', 'ContentType': 'application/gzip'}, Config=REPLAY_TRANSFER)
+
+# Statements run for every game. They are prepared once per pooled connection,
+# so Postgres plans them once instead of on every execution.
+PREPARED_STATEMENTS = {
+    # Only claims a game nobody else is running, so workers woken by the same NOTIFY
+    # can't all start the game they each just selected
+    'start_game': "UPDATE {} SET status='running', start=NOW() WHERE id=$1 AND (status='queued' OR (status='running' AND start < NOW() - INTERVAL '10 min'))",
+    'end_game': "UPDATE {} SET (status, replay, red_logs, blue_logs)=($1,$2,$3,$4) WHERE id=$5 AND status='running'",
+    'reject_game': "UPDATE {} SET status='rejected' WHERE id=$1",
+}
+
+class PreparedConnection(psycopg2.extensions.connection):
+    '''
+    Connection that remembers whether PREPARED_STATEMENTS exist in its session yet.
+    '''
+    prepared = False
+
+@contextlib.contextmanager
+def db_cursor():
+    '''
+    Borrow a connection from the pool for one transaction.
+    Commits when the block exits normally and rolls back if it raises.
+    '''
+    conn = DB_POOL.getconn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                if not conn.prepared:
+                    for name, statement in PREPARED_STATEMENTS.items():
+                        cur.execute("PREPARE " + name + " AS " + statement.format(os.environ["TABLE_NAME"]))
+                    conn.prepared = True
+                yield cur
+    finally:
+        DB_POOL.putconn(conn)
 
+def end_game(data,winner,match_file,logs):
     status = -1
     if winner == 'player1':
         status = 'redwon'
@@ -45,25 +123,32 @@ def end_game(data,winner,match_file,logs):
     red_log_key = key_prefix + 'logs/' + hidden_key + '_0.bc18log'
     blue_log_key = key_prefix + 'logs/' + hidden_key + '_1.bc18log'
 
-    gzipped_replay = gzip.compress(json.dumps(match_file).encode())
+    log_uploads = [
+        (red_log_key, dumps_bytes({'earth':logs[0],'mars':logs[2]})),
+        (blue_log_key, dumps_bytes({'earth':logs[1],'mars':logs[3]})),
+    ]
 
-    bucket.put_object(Key=replay_key,Body=gzipped_replay,ACL='public-read')
-    bucket.put_object(Key=red_log_key,Body=json.dumps({'earth':logs[0],'mars':logs[2]}).encode(),ACL='public-read')
-    bucket.put_object(Key=blue_log_key,Body=json.dumps({'earth':logs[1],'mars':logs[3]}).encode(),ACL='public-read')
+    # The uploads are independent, so run them at the same time rather than one round-trip after another.
+    futures = [UPLOAD_POOL.submit(upload_replay, replay_key, match_file)]
+    futures += [UPLOAD_POOL.submit(S3_CLIENT.put_object, Bucket=bucket.name, Key=key, Body=body, ACL='public-read', ContentType='application/json')
+                for key, body in log_uploads]
+    for future in futures:
+        future.result()
 
-    while DB_LOCK == True:
-        sleep(0.1)
-    DB_LOCK = True
-    cur.execute("UPDATE " + os.environ["TABLE_NAME"] + " SET (status, replay, red_logs, blue_logs)=(%s,%s,%s,%s)  WHERE id=%s AND status='running'", (status,replay_key,red_log_key,blue_log_key,data['id']))
-    pg.commit()
-    DB_LOCK = False
+    with db_cursor() as cur:
+        cur.execute("EXECUTE end_game (%s,%s,%s,%s,%s)", (status,replay_key,red_log_key,blue_log_key,data['id']))
 
     print("Finished game " + str(data['id']))
 
+@functools.lru_cache(maxsize=64)
+def load_map(map_name):
+    '''
+    Tournaments replay the same few maps many times, so only read and parse each once.
+    Sharing the GameMap is safe, the engine copies it when a game is created.
+    '''
+    return cli.get_map(os.path.abspath(os.path.join('..', 'battlecode-maps', map_name)))
+
 def match_thread(data):
-    global BUSY
-    global DB_LOCK
-    BUSY = True
     GAMES_RUN.append(data['id'])
 
     data['s3_bucket'] = bucket
@@ -72,7 +157,7 @@ def match_thread(data):
     data['player_cpu'] = 20
     data['map_name'] = data['map']
 
-    data['map'] = cli.get_map(os.path.abspath(os.path.join('..', 'battlecode-maps', data['map'])))
+    data['map'] = load_map(data['map_name'])
     data['docker'] = True
     data['terminal_viewer'] = False
     data['use_viewer'] = False
@@ -83,12 +168,8 @@ def match_thread(data):
         (game, dockers, sock_file) = cli.create_scrimmage_game(data)
     except ValueError as e:
         print("Destroying the game, as it is invalid.  This should not happen.")
-        while DB_LOCK == True:
-            sleep(0.1)
-        DB_LOCK = True
-        cur.execute("UPDATE " + os.environ["TABLE_NAME"] + " SET status='rejected' WHERE id=%s", (data['id'],))
-        pg.commit()
-        DB_LOCK = False
+        with db_cursor() as cur:
+            cur.execute("EXECUTE reject_game (%s)", (data['id'],))
 
         return
 
@@ -106,63 +187,94 @@ def match_thread(data):
 
     logs = None
     if all('logger' in player for player in game.players):
-        logs = [player['logger'].logs.getvalue() for player in game.players]
+        logs = [player['logger'].take() for player in game.players]
 
     end_game(data,winner,match_file,logs)
 
+def busy():
+    return CURRENT_MATCH is not None and not CURRENT_MATCH.done()
+
+def match_done(future):
+    '''
+    Runs once a match has finished, successfully or not.
+    '''
+    if future.exception() is not None:
+        print("Match failed:", future.exception())
+    # We are free again, so wake up poll_thread to pick up the next game
+    with db_cursor() as cur:
+        cur.execute("NOTIFY " + QUEUE_CHANNEL)
+
 def run_match(data):
-    t1 = threading.Thread(target=match_thread,args=(data,))
-    t1.start()
+    global CURRENT_MATCH
+    CURRENT_MATCH = MATCH_POOL.submit(match_thread, data)
+    CURRENT_MATCH.add_done_callback(match_done)
+
+    return CURRENT_MATCH
 
-    return t1
+def wait_for_notify(conn):
+    '''
+    Block until something is sent on QUEUE_CHANNEL or POLL_TIMEOUT passes.
+    '''
+    if select.select([conn], [], [], POLL_TIMEOUT) != ([], [], []):
+        conn.poll()
+        del conn.notifies[:]
 
 def poll_thread():
-    global DB_LOCK
-    global BUSY
+    listen_conn = DB_POOL.getconn()
+    listen_conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    with listen_conn.cursor() as cur:
+        cur.execute("LISTEN " + QUEUE_CHANNEL)
 
     while True:
-        sleep(1)
-        if BUSY:
+        if busy():
+            wait_for_notify(listen_conn)
             continue
 
-        while DB_LOCK == True:
-            sleep(0.1)
-        DB_LOCK = True
-
-        cur.execute("SELECT (id, red_key, blue_key, map, red_team, blue_team) FROM " + os.environ["TABLE_NAME"] + " WHERE status='queued' or (status='running' and start < (NOW() - INTERVAL '10 min')) ORDER BY start ASC")
+        queued = None
+        lost_claim = False
+        with db_cursor() as cur:
+            cur.execute("SELECT (id, red_key, blue_key, map, red_team, blue_team) FROM " + os.environ["TABLE_NAME"] + " WHERE status='queued' or (status='running' and start < (NOW() - INTERVAL '10 min')) ORDER BY start ASC")
 
-        row = cur.fetchone()
+            row = cur.fetchone()
 
-        if row is not None:
-            if len(row) == 1:
-                row = row[0][1:-1].split(",")
-                row[0] = int(row[0])
+            if row is not None:
+                if len(row) == 1:
+                    row = row[0][1:-1].split(",")
+                    row[0] = int(row[0])
 
-            data = {'id':row[0],'red_key':row[1],'blue_key':row[2],'map':row[3]}
+                data = {'id':row[0],'red_key':row[1],'blue_key':row[2],'map':row[3]}
 
-            if not BUSY:
-                BUSY = True
-                print('Running game ' + str(data))
-                cur.execute("UPDATE " + os.environ['TABLE_NAME'] + " SET status='running', start=NOW() WHERE id=%s",(data['id'],))
-                pg.commit()
+                if not busy():
+                    cur.execute("EXECUTE start_game (%s)",(data['id'],))
 
-                try:
-                    PROXY_UPLOADER.game_id = row[0]
-                    PROXY_UPLOADER.red_id = row[4]
-                    PROXY_UPLOADER.blue_id = row[5]
-                except Exception as e:
-                    print("error setting team data:", e)
+                    # No row updated means another worker got to the game first, leave it to them
+                    lost_claim = cur.rowcount != 1
+                    if not lost_claim:
+                        print('Running game ' + str(data))
+                        try:
+                            PROXY_UPLOADER.game_id = row[0]
+                            PROXY_UPLOADER.red_id = row[4]
+                            PROXY_UPLOADER.blue_id = row[5]
+                        except Exception as e:
+                            print("error setting team data:", e)
 
-                run_match(data)
+                        queued = data
 
-        DB_LOCK = False
+        # Only start the match once the 'running' status has been committed
+        if queued is not None:
+            run_match(queued)
+        elif not lost_claim:
+            # After a lost claim, rescan at once in case more games are queued
+            wait_for_notify(listen_conn)
 
 if __name__ == "__main__":
     try:
-        pg = psycopg2.connect("dbname='battlecode' user='battlecode' host='" + os.environ["DB_HOST"] + "' password='" + os.environ["DB_PASS"] + "'")
-        cur = pg.cursor()
+        # Two connections are opened up front: poll_thread's LISTEN connection and
+        # one for transactions, so the first game doesn't pay for a connect
+        DB_POOL = psycopg2.pool.ThreadedConnectionPool(2, 4, "dbname='battlecode' user='battlecode' host='" + os.environ["DB_HOST"] + "' password='" + os.environ["DB_PASS"] + "'", connection_factory=PreparedConnection)
         print("Connected to postgres.")
     except:
         print("Could not connect to postgres.")
 
+    PROXY_UPLOADER.start()
     poll_thread()
@@ -4,17 +4,22 @@ This starts the socket server to which things connect to play the game
 '''
 
 import socketserver
-import socket # pylint: disable=unused-import
+import socket
 import threading
 import time
 import random
+import secrets
 import sys
 import logging
 import os.path
 try:
-    import ujson as json
+    # Only json.loads is used here, which orjson provides and which takes the bytes we read as is
+    import orjson as json
 except:
-    import json
+    try:
+        import ujson as json
+    except:
+        import json
 import battlecode as bc
 
 NUM_PLAYERS = 4
@@ -30,10 +35,16 @@ PKEYS = {
     }
 }
 def _key(p):
-    p = p['player']
-    return PKEYS[int(p.planet)][int(p.team)]
+    return p['sort_key']
 
 BUILD_TIMEOUT = 60
+# Most bytes read from a socket at once
+RECV_SIZE = 65536
+# Envelope of every message sent to a player, and the part of it before the message
+MESSAGE_PREFIX_TEMPLATE = b'{"logged_in":%s,"client_id":"%d","error":%s,"message":'
+MESSAGE_TEMPLATE = MESSAGE_PREFIX_TEMPLATE + b'%s}'
+# Kernel buffer size asked for on each connection, so a whole turn or viewer batch fits
+SOCKET_BUFFER_SIZE = 256 * 1024
 TIMEOUT = 50 # seconds
 
 class TimeoutError(Exception):
@@ -58,6 +69,8 @@ class Game(object): # pylint: disable=too-many-instance-attributes
         self.time_pool = time_pool/1000.
         self.time_additional = time_additional/1000.
         logging.basicConfig(filename=logging_file, level=logging_level)
+        # Checked before the logging.debug calls made every turn, which are off outside of debugging
+        self.debug_logging = logging.getLogger().isEnabledFor(logging.DEBUG)
         '''
         Initialize Game object
         Args:
@@ -65,8 +78,12 @@ class Game(object): # pylint: disable=too-many-instance-attributes
             state:       Start state of game (Note can be snapshot
         '''
         self.players = [] # Array containing the player ids
-        # Dict taking player id and giving bool of log in
-        self.player_logged = {}
+        # Dict taking player id and giving its index in players
+        self.player_indices = {}
+        # Ids of the players that have logged in
+        self.logged_in_ids = set()
+        # Players log in on their own threads; this keeps their logins from interleaving
+        self.login_lock = threading.Lock()
         # Dict taking player id and giving amount of time left as float
         self.times = {}
         # List of how many players per team are connected (red,blue).
@@ -76,9 +93,19 @@ class Game(object): # pylint: disable=too-many-instance-attributes
 
         # Initialize the players
         for index in range(NUM_PLAYERS):
-            new_id = random.randrange(10**30)
+            # Ids are what players log in with, so they must be unguessable and distinct
+            new_id = secrets.randbelow(10**30)
+            while new_id in self.player_indices:
+                new_id = secrets.randbelow(10**30)
+            self.player_indices[new_id] = index
             self.players.append({'id':new_id})
-            self.players[-1]['player'] = bc.Player(bc.Team.Red if index % 2 == 0 else bc.Team.Blue, bc.Planet.Earth if index < 2 else bc.Planet.Mars)
+            team = bc.Team.Red if index % 2 == 0 else bc.Team.Blue
+            planet = bc.Planet.Earth if index < 2 else bc.Planet.Mars
+            self.players[-1]['player'] = bc.Player(team, planet)
+            # Worked out once here, rather than asking the engine's enums every time they are needed
+            self.players[-1]['team_name'] = 'red' if team == bc.Team.Red else 'blue'
+            self.players[-1]['planet_name'] = 'earth' if planet == bc.Planet.Earth else 'mars'
+            self.players[-1]['sort_key'] = PKEYS[int(planet)][int(team)]
             self.players[-1]['running_stats'] = {
                 "tl": time_pool,
                 "atu": 0,
@@ -87,41 +114,69 @@ class Game(object): # pylint: disable=too-many-instance-attributes
             }
             self.players[-1]['built_successfully'] = False
 
-            self.player_logged[new_id] = False
             self.times[new_id] = self.time_pool
 
+        # Order the terminal viewer shows players in, which never changes
+        self.sorted_players = sorted(self.players, key=_key)
+
         self.started = False
-        self.game_over = False
+        # Set when the game starts, or ends before it could, so logged in players stop waiting
+        self.started_event = threading.Event()
 
         # Lock thread running player should hold
         self.current_player_index = 0
         self.turn_events = [threading.Event() for _  in range(len(self.players))]
+        # Set when the game ends, for whoever is waiting on the game from outside
+        self.game_over_event = threading.Event()
+        self.game_over = False
 
         self.map = game_map
 
         self.manager = bc.GameController.new_manager(self.map)
         for player in self.players:
-            player['start_message'] = self.manager.start_game(player['player']).to_json()
+            player['start_message'] = self.manager.start_game(player['player']).to_json().encode()
         self.viewer_messages = []
+        # Notified when viewer_messages grows or the game ends
+        self.viewer_condition = threading.Condition()
         manager_start_message = self.manager.initial_start_turn_message(int(1000 * self.time_pool))
         self.manager_viewer_messages = []
         self.manager_viewer_messages.append(self.manager.manager_viewer_message())
-        self.last_message = manager_start_message.start_turn.to_json()
+        # Kept encoded, as every player is sent it unchanged
+        self.last_message = manager_start_message.start_turn.to_json().encode()
         self.viewer_messages.append(manager_start_message.viewer.to_json())
-        self.initialized = 0
 
         self.map_name = map_name
+        # The map's file name without directory or extensions, as shown in state reports
+        self.report_map_name = map_name
+        if '/' in self.report_map_name:
+            self.report_map_name = self.report_map_name[self.report_map_name.rfind('/') + 1:]
+        if '.' in self.report_map_name:
+            self.report_map_name = self.report_map_name[:self.report_map_name.find('.')]
         self.start_time = time.time()
 
+    @property
+    def game_over(self):
+        return self._game_over
+
+    @game_over.setter
+    def game_over(self, value):
+        '''
+        Ending the game wakes every player waiting for the game to start or in
+        start_turn, so they can block on their events without a timeout
+        '''
+        self._game_over = value
+        if value:
+            self.game_over_event.set()
+            self.started_event.set()
+            for event in self.turn_events:
+                event.set()
+            with self.viewer_condition:
+                self.viewer_condition.notify_all()
+
     def state_report(self):
-        name = self.map_name
-        if '/' in name:
-            name = name[name.rfind('/') + 1:]
-        if '.' in name:
-            name = name[:name.find('.')]
         game = {
             "id": 0, #unknown
-            "map": name,
+            "map": self.report_map_name,
             "round": self.manager.round(),
             "time": int((time.time() - self.start_time) * 1000),
             "red": {
@@ -132,17 +187,14 @@ class Game(object): # pylint: disable=too-many-instance-attributes
             }
         }
         for player in self.players:
-            p = player["player"]
-            t = "red" if p.team == bc.Team.Red else "blue"
-            p = "earth" if p.planet == bc.Planet.Earth else "mars"
-            game[t][p] = player["running_stats"]
+            game[player["team_name"]][player["planet_name"]] = player["running_stats"]
         return game
 
     def player_id2index(self, client_id):
-        for i in range(len(self.players)):
-            if self.players[i]['id'] ==client_id:
-                return i
-        raise Exception("Invalid id")
+        try:
+            return self.player_indices[client_id]
+        except KeyError:
+            raise Exception("Invalid id")
 
     def get_player(self, client_id):
         return self.players[self.player_id2index(client_id)]
@@ -151,16 +203,31 @@ class Game(object): # pylint: disable=too-many-instance-attributes
         index = self.player_id2index(client_id)
         self.connected_players[index%2] = self.connected_players[index%2] + 1
 
+    def record_disconnect(self, client_id):
+        '''
+        Ends the game because client_id's player dropped out, and gives the
+        win to the other team
+        '''
+        team_name = self.get_player(client_id)['team_name']
+        if team_name == 'red':
+            self.winner = 'player2'
+        elif team_name == 'blue':
+            self.winner = 'player1'
+        else:
+            if self.connected_players[0] == self.connected_players[1]:
+                print("Determining match by coin toss.")
+                self.winner = 'player1' if random.random() > 0.5 else 'player2'
+            else:
+                self.winner = 'player1' if self.connected_players[0] > self.connected_players[1] else 'player2'
+        self.disconnected = True
+        self.game_over = True
+
     @property
     def num_log_in(self):
         '''
         Returns the number of people who have been logged in
         '''
-        total = 0
-        for key in self.player_logged:
-            if self.player_logged[key]:
-                total += 1
-        return total
+        return len(self.logged_in_ids)
 
     def verify_login(self, unpacked_data: str):
         '''
@@ -176,19 +243,20 @@ class Game(object): # pylint: disable=too-many-instance-attributes
         client_id = int(unpacked_data['client_id'])
 
         # Check if they are in our list of clients
-        if client_id not in [player['id'] for player in self.players]:
+        if client_id not in self.player_indices:
             return "Client id Mismatch"
 
-        # Check if they logged in already
-        if self.player_logged[client_id]:
-            return "Already Logged In"
+        with self.login_lock:
+            # Check if they logged in already
+            if client_id in self.logged_in_ids:
+                return "Already Logged In"
 
-        self.player_logged[client_id] = True
+            self.logged_in_ids.add(client_id)
 
-        # Check if all the players are logged in and then start the game
-        logging.info("Player logged in: %s", self.player_logged)
-        if len(self.players) == self.num_log_in:
-            self.start_game()
+            # Check if all the players are logged in and then start the game
+            logging.info("Player logged in: %s", self.logged_in_ids)
+            if len(self.players) == self.num_log_in:
+                self.start_game()
         return client_id
 
     def set_player_turn(self, player_index):
@@ -209,6 +277,7 @@ class Game(object): # pylint: disable=too-many-instance-attributes
         self.current_player_index = 0
         self.set_player_turn(self.current_player_index)
         self.started = True
+        self.started_event.set()
         return
 
 
@@ -244,9 +313,8 @@ class Game(object): # pylint: disable=too-many-instance-attributes
                 # Clear the screen from the cursor to the end of the screen.
                 # Just in case some text has been left over there from earlier frames.
                 sys.stdout.write("\033[J")
-            for player in sorted(self.players, key=_key):
-                p = player['player']
-                print('-- [{}{}] --'.format('e' if p.planet == bc.Planet.Earth else 'm', 'r' if p.team == bc.Team.Red else 'b'))
+            for player in self.sorted_players:
+                print('-- [{}{}] --'.format(player['planet_name'][0], player['team_name'][0]))
                 logs = player['logger'].logs.getvalue()[-1000:].splitlines()[-5:]
                 for line in logs:
                     print(line)
@@ -261,17 +329,21 @@ class Game(object): # pylint: disable=too-many-instance-attributes
 
     def get_viewer_messages(self):
         '''
-        A generator for the viewer messages
+        A generator for the viewer messages.
+        Yields lists of every message added since the last yield, so they
+        can be sent together
         '''
         # TODO check this works with the way the engine works
         max_yield_item = 0
-        while not self.game_over or max_yield_item != len(self.viewer_messages):
-            if len(self.viewer_messages) > max_yield_item:
+        while True:
+            with self.viewer_condition:
+                self.viewer_condition.wait_for(lambda: self.game_over or len(self.viewer_messages) > max_yield_item)
                 new_max = len(self.viewer_messages)
-                for i in range(max_yield_item, new_max):
-                    yield self.viewer_messages[i]
+            if new_max > max_yield_item:
+                yield self.viewer_messages[max_yield_item:new_max]
                 max_yield_item = new_max
-            time.sleep(0.1)
+            elif self.game_over:
+                return
 
     def start_turn(self, client_id: int):
         '''
@@ -283,17 +355,17 @@ class Game(object): # pylint: disable=too-many-instance-attributes
         This also handles waking the docker instances to start computing
         '''
 
-        logging.debug("Client %s: entered start turn", client_id)
-        exit_well = False
+        if self.debug_logging:
+            logging.debug("Client %s: entered start turn", client_id)
         player_index = self.player_id2index(client_id)
-        while not self.game_over:
-            if self.turn_events[player_index].wait(timeout=0.1):
-                self.turn_events[player_index].clear()
-                assert(self.current_player_index == player_index)
-                self.times[client_id] += self.time_additional
-                return True
+        self.turn_events[player_index].wait()
+        if self.game_over:
+            return False
 
-        return False
+        self.turn_events[player_index].clear()
+        assert(self.current_player_index == player_index)
+        self.times[client_id] += self.time_additional
+        return True
 
     def make_action(self, turn_message: bc.TurnMessage, client_id: int, diff_time: float):
         '''
@@ -309,8 +381,10 @@ class Game(object): # pylint: disable=too-many-instance-attributes
 
         # interact with the engine
         application = self.manager.apply_turn(turn_message, projected_time_ms)
-        self.last_message = application.start_turn.to_json()
-        self.viewer_messages.append(application.viewer.to_json())
+        self.last_message = application.start_turn.to_json().encode()
+        with self.viewer_condition:
+            self.viewer_messages.append(application.viewer.to_json())
+            self.viewer_condition.notify_all()
         self.manager_viewer_messages.append(self.manager.manager_viewer_message())
         self.times[client_id] -= diff_time
         return
@@ -345,82 +419,62 @@ def create_receive_handler(game: Game, dockers, use_docker: bool,
             self.client_id = 0
             self.error = ""
             self.logged_in = False
+            # Start of every message sent once logged in; only the state diff after it changes
+            self.message_prefix = b''
             self.is_unix_stream = is_unix_stream
-            self.buffer_small = b''
-            self.buffer_large = []
+            # Received bytes not yet returned by read_line, and the buffer recv reads into
+            self.buffer = bytearray()
+            self.recv_buffer = bytearray(RECV_SIZE)
+            self.recv_view = memoryview(self.recv_buffer)
 
             super(ReceiveHandler, self).__init__(*args, **kwargs)
 
+        def setup(self):
+            '''
+            Configures the socket once it is accepted, before handle runs
+            '''
+            self.request.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+            if self.request.family in (socket.AF_INET, socket.AF_INET6):
+                # Unix sockets only use the sender's buffer, so the receive side only matters over TCP
+                self.request.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+                # Messages are small and each waits for a reply, so don't let Nagle's algorithm hold them back
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
         def read_line(self):
+            # Only search the bytes that arrived since the last look
+            start = 0
             while True:
-                if self.buffer_small:
-                    pos = self.buffer_small.find(b'\n')
-                    if pos != -1:
-                        ret = b''.join(self.buffer_large) + self.buffer_small[:pos]
-                        self.buffer_small = self.buffer_small[pos+1:]
-                        self.buffer_large = []
-                        return ret
-                    else:
-                        self.buffer_large.append(self.buffer_small)
-                self.buffer_small = self.request.recv(4096)
-                if not self.buffer_small:
+                pos = self.buffer.find(b'\n', start)
+                if pos != -1:
+                    ret = bytes(self.buffer[:pos])
+                    del self.buffer[:pos+1]
+                    return ret
+                start = len(self.buffer)
+                received = self.request.recv_into(self.recv_buffer)
+                if not received:
                     raise IOError("reached socket EOF before finding newline")
+                self.buffer += self.recv_view[:received]
 
         def get_next_message(self) -> object:
             '''
-            Returns the json loaded object of the next string that is sent over the
-            socket
+            Returns the next line that is sent over the socket
 
             Returns:
-                An object, for our purposes this will be a dictionary, of the json
-                loaded string
+                The bytes of the line, stripped of surrounding whitespace
             '''
 
-            recv_socket = self.request
-            game = self.game
-
-            logging.debug("Client %s: Waiting for next message", self.client_id)
+            if self.game.debug_logging:
+                logging.debug("Client %s: Waiting for next message", self.client_id)
             try:
                 data = self.read_line()
             except (StopIteration, IOError):
-                print("{} has not sent message for {} seconds, assuming they're dead".format(
-                    self.game.get_player(self.client_id)['player'],
-                    TIMEOUT
-                ))
-                recv_socket.close()
-                if bc.Team.Red == self.game.get_player(self.client_id)['player'].team:
-                    self.game.winner = 'player2'
-                elif bc.Team.Blue == self.game.get_player(self.client_id)['player'].team:
-                    self.game.winner = 'player1'
-                else:
-                    if self.game.connected_players[0] == self.game.connected_players[1]:
-                        print("Determining match by coin toss.")
-                        self.game.winner = 'player1' if random.random() > 0.5 else 'player2'
-                    else:
-                        self.game.winner = 'player1' if self.game.connected_players[0] > self.game.connected_players[1] else 'player2'
-                self.game.disconnected = True
-                self.game.game_over = True
+                self.drop_connection("{} has not sent message for {} seconds, assuming they're dead")
                 raise TimeoutError()
             except KeyboardInterrupt:
-                recv_socket.close()
-                if bc.Team.Red == self.game.get_player(self.client_id)['player'].team:
-                    self.game.winner = 'player2'
-                elif bc.Team.Blue == self.game.get_player(self.client_id)['player'].team:
-                    self.game.winner = 'player1'
-                else:
-                    if self.game.connected_players[0] == self.game.connected_players[1]:
-                        print("Determining match by coin toss.")
-                        self.game.winner = 'player1' if random.random() > 0.5 else 'player2'
-                    else:
-                        self.game.winner = 'player1' if self.game.connected_players[0] > self.game.connected_players[1] else 'player2'
-                self.game.disconnected = True
-                self.game.game_over = True
-                raise KeyboardInterrupt()
-
-            data = data.decode("utf-8").strip()
-            return data
-            #unpacked_data = json.loads(data)
-            #return unpacked_data
+                self.drop_connection()
+                raise
+
+            return data.strip()
 
         def send_message(self, obj: object) -> None:
             '''
@@ -435,76 +489,69 @@ def create_receive_handler(game: Game, dockers, use_docker: bool,
                 None
             '''
 
+            if not isinstance(obj, bytes):
+                obj = obj.encode()
 
-            send_socket = self.request
-            if isinstance(obj, bytes):
-                obj = obj.decode()
+            self.send_line(obj + b"\n")
 
-            message = obj + "\n"
-            encoded_message = message.encode()
-            logging.debug("Client %s: Sending message %s", self.client_id,
-                          encoded_message)
+        def send_line(self, encoded_message: bytes) -> None:
+            '''
+            Sends a message that is already encoded and ends in a newline
+            '''
+
+            if self.game.debug_logging:
+                logging.debug("Client %s: Sending message %s", self.client_id,
+                              encoded_message)
 
             try:
                 self.request.sendall(encoded_message)
             except IOError:
-                send_socket.close()
-                print("{} has not accepted message for {} seconds, assuming they're dead".format(
-                    [p for p in self.game.players if p['id'] == self.client_id][0]['player'],
-                    TIMEOUT
-                ))
-                if bc.Team.Red == self.game.get_player(self.client_id)['player'].team:
-                    self.game.winner = 'player2'
-                elif bc.Team.Blue ==self.game.get_player(self.client_id)['player'].team:
-                    self.game.winner = 'player1'
-                else:
-                    if self.game.connected_players[0] == self.game.connected_players[1]:
-                        print("Determining match by coin toss.")
-                        self.game.winner = 'player1' if random.random() > 0.5 else 'player2'
-                    else:
-                        self.game.winner = 'player1' if self.game.connected_players[0] > self.game.connected_players[1] else 'player2'
-                self.game.disconnected = True
-                self.game.game_over = True
+                self.drop_connection("{} has not accepted message for {} seconds, assuming they're dead")
                 raise TimeoutError()
             except KeyboardInterrupt:
-                send_socket.close()
-                if bc.Team.Red == self.game.get_player(self.client_id)['player'].team:
-                    self.game.winner = 'player2'
-                elif bc.Team.Blue ==self.game.get_player(self.client_id)['player'].team:
-                    self.game.winner = 'player1'
-                else:
-                    if self.game.connected_players[0] == self.game.connected_players[1]:
-                        print("Determining match by coin toss.")
-                        self.game.winner = 'player1' if random.random() > 0.5 else 'player2'
-                    else:
-                        self.game.winner = 'player1' if self.game.connected_players[0] > self.game.connected_players[1] else 'player2'
-                self.game.disconnected = True
-                self.game.game_over = True
-                raise KeyboardInterrupt()
+                self.drop_connection()
+                raise
             return
 
+        def drop_connection(self, reason=None):
+            '''
+            Closes the socket after a failed read or write. If this connection
+            had logged in, its player forfeits the game, and reason, if given,
+            is printed with the player and TIMEOUT filled in.
+            '''
+            self.request.close()
+            # A connection that never logged in has no player to forfeit
+            if not self.logged_in:
+                return
+            if reason is not None:
+                print(reason.format(self.game.get_player(self.client_id)['player'], TIMEOUT))
+            self.game.record_disconnect(self.client_id)
+
         def message(self, state_diff):
             '''
             Compress the current state into a message that will be sent to the
             client
+
+            state_diff is put into the envelope as is, so it must already be
+            JSON, as str or bytes, or "" for an empty message
             '''
             if self.error == "":
-                error = "null"
+                error = b"null"
             else:
-                self.docker.destroy()
+                # Errors are verify_login's fixed messages, which need no escaping
+                error = b'"' + self.error.encode() + b'"'
 
             if state_diff == "":
-                state_diff = '""'
-            if isinstance(state_diff, bytes):
-                state_diff = state_diff.decode()
+                state_diff = b'""'
+            elif not isinstance(state_diff, bytes):
+                state_diff = state_diff.encode()
 
             if self.logged_in:
-                logged_in = "true"
+                logged_in = b"true"
             else:
-                logged_in = "false"
+                logged_in = b"false"
 
-            message = '{{"logged_in":{},"client_id":"{}","error":{},"message":{}}}'.format(logged_in, self.client_id, error, state_diff)
-            return message
+            return MESSAGE_TEMPLATE % (logged_in, self.client_id, error, state_diff)
 
         def player_handler(self):
             '''
@@ -532,6 +579,7 @@ def create_receive_handler(game: Game, dockers, use_docker: bool,
                     logging.info("Client %s: logged in succesfully", self.client_id)
                     self.logged_in = True
                     self.client_id = verify_out
+                    self.message_prefix = MESSAGE_PREFIX_TEMPLATE % (b"true", self.client_id, b"null")
                     self.game.player_connected(self.client_id)
                     self.game.get_player(self.client_id)['built_successfully'] = True
 
@@ -542,12 +590,10 @@ def create_receive_handler(game: Game, dockers, use_docker: bool,
             if self.game.game_over:
                 return
 
-            logging.debug("Client %s: Spinning waiting for game to start",
+            logging.debug("Client %s: Waiting for game to start",
                           self.client_id)
 
-            while not self.game.started and not self.game.game_over:
-                # Spin while waiting for game to start
-                time.sleep(0.05)
+            self.game.started_event.wait()
 
             logging.info("Client %s: Game started", self.client_id)
 
@@ -556,6 +602,8 @@ def create_receive_handler(game: Game, dockers, use_docker: bool,
 
             # average time used, in seconds
             atu = 0
+            # A player's first turn only delivers its start message, which it doesn't reply to
+            sent_start_message = False
 
             while self.game.started and not self.game.game_over:
                 # This is the loop that the code will always remain in
@@ -570,29 +618,28 @@ def create_receive_handler(game: Game, dockers, use_docker: bool,
                     self.request.close()
                     return
 
-                logging.debug("Client %s: Started turn", self.client_id)
+                if self.game.debug_logging:
+                    logging.debug("Client %s: Started turn", self.client_id)
 
-                if self.game.initialized > 3:
-                    start_turn_msg = self.message(self.game.last_message)
-                else:
-                    state_diff = self.game.players[self.game.current_player_index]['start_message']
-                    start_turn_msg = self.message(state_diff)
+                if not sent_start_message:
+                    state_diff = self.game.get_player(self.client_id)['start_message']
                     running_stats["lng"] = my_sandbox.guess_language()
                     running_stats["bld"] = False
 
-                if self.game.initialized <= 3:
                     my_sandbox.unpause()
-                    self.send_message(start_turn_msg)
-                    self.game.initialized += 1
+                    self.send_message(self.message(state_diff))
+                    sent_start_message = True
                     self.game.end_turn()
                     continue
 
                 if self.game.times[self.client_id] > 0:
+                    # Built in one go, newline included, to skip the copies send_message would make
+                    start_turn_msg = b''.join((self.message_prefix, self.game.last_message, b'}\n'))
                     my_sandbox.unpause()
 
                     start_time = time.perf_counter()
                     start_time_python = time.process_time()
-                    self.send_message(start_turn_msg)
+                    self.send_line(start_turn_msg)
                     data = self.get_next_message()
                     end_time_python = time.process_time()
                     end_time = time.perf_counter()
@@ -602,24 +649,13 @@ def create_receive_handler(game: Game, dockers, use_docker: bool,
                     my_sandbox.pause()
 
                     try:
-                        sent_message = bc.SentMessage.from_json(data)
+                        sent_message = bc.SentMessage.from_json(data.decode())
                     except Exception as e:
                         print("Error deserializing JSON")
                         print(e)
                         print("Killing player...")
 
-                        if bc.Team.Red == self.game.get_player(self.client_id)['player'].team:
-                            self.game.winner = 'player2'
-                        elif bc.Team.Blue ==self.game.get_player(self.client_id)['player'].team:
-                            self.game.winner = 'player1'
-                        else:
-                            if self.game.connected_players[0] == self.game.connected_players[1]:
-                                print("Determining match by coin toss.")
-                                self.game.winner = 'player1' if random.random() > 0.5 else 'player2'
-                            else:
-                                self.game.winner = 'player1' if self.game.connected_players[0] > self.game.connected_players[1] else 'player2'
-                        self.game.disconnected = True
-                        self.game.game_over = True
+                        self.game.record_disconnect(self.client_id)
 
 
                     assert int(sent_message.client_id) == self.client_id, \
@@ -647,9 +683,11 @@ def create_receive_handler(game: Game, dockers, use_docker: bool,
             '''
             This handles the connection to the viewer
             '''
-            for message in self.game.get_viewer_messages():
+            for messages in self.game.get_viewer_messages():
                 # TODO check this schema works for the viewer
-                self.send_message(message)
+                # One write for everything that arrived since the last one.
+                # The empty string on the end gives the batch its final newline without another copy.
+                self.send_line("\n".join(messages + [""]).encode())
 
         def handle(self):
             '''
@@ -697,12 +735,7 @@ def start_server(sock_file: str, game: Game, dockers, use_docker=True) -> socket
         for player in game.players:
             if not player['built_successfully']:
                 print('Player failed to connect to manager after',BUILD_TIMEOUT,'seconds:', player['player'])
-                if bc.Team.Red == player['player'].team:
-                    game.winner = 'player2'
-                else:
-                    game.winner = 'player1'
-                game.disconnected = True
-                game.game_over = True
+                game.record_disconnect(player['id'])
 
     server_thread = threading.Thread(target=server.serve_forever, daemon=True)
     logging.info("Server Started at %s", sock_file)
@@ -48,6 +48,7 @@ def run_game(map_path, player1dir, player2dir, replay_dir, docker, terminal_view
         up.blue_id = 100
         up.blue_id = 1000
         up.game = game
+        up.start()
 
     try:
         winner = cli.run_game(game, sandboxes, args, sock_file)
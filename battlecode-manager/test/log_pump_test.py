@@ -0,0 +1,93 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from player_plain import LogPump
+
+class FakePlayer(object):
+    # LogPump only looks at process, to know whether the player is shutting down
+    process = True
+
+def strict_logger(lines):
+    def line_action(line):
+        # Decodes like a logger that doesn't expect bad bytes
+        lines.append(line.decode())
+    return line_action
+
+def test_invalid_utf8_does_not_stop_other_players():
+    pump = LogPump()
+
+    bad_read, bad_write = os.pipe()
+    good_read, good_write = os.pipe()
+    # Keep the stream objects alive, collecting them would close the pipes
+    bad_stream = os.fdopen(bad_read, 'rb')
+    good_stream = os.fdopen(good_read, 'rb')
+    bad_lines = []
+    good_lines = []
+    pump.add(FakePlayer(), bad_stream, strict_logger(bad_lines))
+    pump.add(FakePlayer(), good_stream, strict_logger(good_lines))
+
+    os.write(bad_write, b'ok\n\xff\n')
+    time.sleep(0.1)
+
+    # More than a pipe buffer from each player, so a dead pump would leave the writers blocked
+    def write_lines(fd, count):
+        for i in range(count):
+            os.write(fd, b'line %d\n' % i)
+        os.close(fd)
+    writers = [threading.Thread(target=write_lines, args=(bad_write, 20000), daemon=True),
+               threading.Thread(target=write_lines, args=(good_write, 20000), daemon=True)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join(10)
+        assert not writer.is_alive()
+
+    deadline = time.time() + 10
+    while len(good_lines) < 20000 and time.time() < deadline:
+        time.sleep(0.05)
+
+    assert bad_lines == ['ok\n']
+    assert len(good_lines) == 20000
+    assert good_lines[-1] == 'line 19999\n'
+    bad_stream.close()
+    good_stream.close()
+
+def test_stale_key_does_not_read_reused_fd():
+    pump = LogPump()
+
+    old_read, old_write = os.pipe()
+    old_stream = os.fdopen(old_read, 'rb')
+    old_lines = []
+    pump.add(FakePlayer(), old_stream, strict_logger(old_lines))
+    # What the pump thread would still hold from its last select() when the player is destroyed
+    stale_key = pump.selector.get_key(old_read)
+
+    pump.remove(old_stream)
+    deadline = time.time() + 10
+    while not old_stream.closed and time.time() < deadline:
+        time.sleep(0.01)
+    assert old_stream.closed
+    os.close(old_write)
+
+    # The next player's pipe gets the freed fd number
+    new_read, new_write = os.pipe()
+    assert new_read == old_read
+    new_stream = os.fdopen(new_read, 'rb')
+    new_lines = []
+    pump.add(FakePlayer(), new_stream, strict_logger(new_lines))
+
+    pump._read(stale_key)
+    assert pump.selector.get_key(new_read).data[3] is new_stream
+
+    os.write(new_write, b'hello\n')
+    os.close(new_write)
+    deadline = time.time() + 10
+    while not new_stream.closed and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert old_lines == []
+    assert new_lines == ['hello\n']
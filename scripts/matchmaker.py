@@ -15,6 +15,8 @@ MATCH_PERIOD = 0.75
 QUEUED_MATCHES = {}
 DB_LOCK = False
 QUEUE_RANGE = 50
+# Scrimmage workers LISTEN on this channel (see battlecode-manager/scrimmage.py)
+QUEUE_CHANNEL = 'game_queued'
 MAPS = ['socket.bc18map','bananas.bc18t','julia.bc18t']
 
 def update_loop():
@@ -124,6 +126,9 @@ while True:
         cur.execute("INSERT INTO match_kube (red_key, blue_key, map, status, red_team, blue_team) VALUES (%s,%s,%s,'queued',%s,%s) RETURNING id",(match['red']['s3'],match['blue']['s3'],random_map,match['red']['id'],match['blue']['id']))
         pg.commit()
         QUEUED_MATCHES[cur.fetchone()[0]] = match
+    # Wake idle scrimmage workers now rather than at their next rescan
+    cur.execute("NOTIFY " + QUEUE_CHANNEL)
+    pg.commit()
     DB_LOCK = False
 
     sleep(int(MATCH_PERIOD*60))
@@ -18,6 +18,9 @@ NUM_MAPS_PER_GAME = 3
 COLOR_RED = 'RED'
 COLOR_BLUE = 'BLUE'
 
+# Scrimmage workers LISTEN on this channel (see battlecode-manager/scrimmage.py)
+QUEUE_CHANNEL = 'game_queued'
+
 team_submission = {}
 
 
@@ -281,6 +284,8 @@ def queue_round(conn, round_num, maps):
         red = get_next_team_and_from(conn, round_num, index, COLOR_RED)
         blue = get_next_team_and_from(conn, round_num, index, COLOR_BLUE)
         queue_match(conn, round_num, index, red, blue, maps)
+    # Delivered on commit, so workers wake up once the whole round is queued
+    cur.execute('NOTIFY ' + QUEUE_CHANNEL)
     conn.commit()
     cur.close()
 
@@ -296,6 +301,8 @@ def queue_initial_round(conn, teams, maps):
         red = (teams[2 * index], None)
         blue = (teams[2 * index + 1], None)
         queue_match(conn, round_num, index, red, blue, maps)
+    # Delivered on commit, so workers wake up once the whole round is queued
+    cur.execute('NOTIFY ' + QUEUE_CHANNEL)
     conn.commit()
     cur.close()
 